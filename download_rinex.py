@@ -39,12 +39,16 @@ Note: This script uses UNAVCO metadata API via bounding-box query, avoiding unsu
 
 import os
 import sys
+import csv
+import sqlite3
+import asyncio
+import queue
+import threading
+import httpx
 import requests
 import logging
-import threading
-from datetime import date, datetime, timedelta
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import pandas as pd
+from datetime import date, datetime
+import numpy as np
 
 # ========== Configuration ==========
 TOKEN_ENV_VAR = "EARTHSCOPE_TOKEN"
@@ -76,7 +80,10 @@ def get_bearer_token():
 def query_metadata_bbox(min_lat, max_lat, min_lon, max_lon):
     """
     Query UNAVCO GNSS metadata API for stations within bounding box.
-    Returns a pandas DataFrame with JSON fields, including 'id', 'session_start_time', 'session_stop_time', 'latitude', 'longitude'.
+    Returns the raw list of station record dicts, including 'id',
+    'session_start_time', 'session_stop_time', 'latitude', 'longitude'.
+    The list is tiny (hundreds of stations); building a DataFrame around it
+    was pure overhead.
     """
     base_url = "https://web-services.unavco.org/gps/metadata/sites/v1"
     params = {
@@ -96,11 +103,10 @@ def query_metadata_bbox(min_lat, max_lat, min_lon, max_lon):
     if not isinstance(data, list):
         logger.error("Unexpected metadata response format; expected a list of station records.")
         sys.exit(1)
-    df = pd.DataFrame(data)
-    if 'id' not in df.columns:
+    if not all('id' in rec for rec in data):
         logger.error("Metadata response does not contain 'id' field.")
         sys.exit(1)
-    return df
+    return data
 
 def load_station_list(file_path):
     """
@@ -116,96 +122,125 @@ def load_station_list(file_path):
         sys.exit(1)
     return stations
 
-def parse_session_periods(df_metadata):
+def parse_session_periods(records):
     """
-    From DataFrame with columns 'id','session_start_time','session_stop_time',
+    From station record dicts with 'id','session_start_time','session_stop_time',
     parse ISO8601 times into datetime.date, return dict station_id -> (start_date, stop_date).
     """
-    station_periods = {}
-    for _, row in df_metadata.iterrows():
-        sid = row['id']
-        s_start = row.get('session_start_time', None)
-        s_stop = row.get('session_stop_time', None)
-        # Parse ISO8601 if present
-        if isinstance(s_start, str) and pd.notna(s_start):
-            try:
-                dt0 = datetime.fromisoformat(s_start.rstrip("Z"))
-                start_d = dt0.date()
-            except:
-                start_d = None
-        else:
-            start_d = None
-        if isinstance(s_stop, str) and pd.notna(s_stop):
-            try:
-                dt1 = datetime.fromisoformat(s_stop.rstrip("Z"))
-                stop_d = dt1.date()
-            except:
-                stop_d = None
-        else:
-            stop_d = None
-        station_periods[sid] = (start_d, stop_d)
-    return station_periods
-
-def generate_candidate_filenames(station: str, current_date: date):
+    def _parse(value):
+        if not isinstance(value, str) or not value:
+            return None
+        try:
+            return datetime.fromisoformat(value.rstrip("Z")).date()
+        except ValueError:
+            return None
+
+    return {rec['id']: (_parse(rec.get('session_start_time')),
+                        _parse(rec.get('session_stop_time')))
+            for rec in records}
+
+def make_date_info(current_date: date, rinex_root: str):
     """
-    Return a list of possible RINEX filenames to try for station/date.
-    Includes lowercase and uppercase station codes.
+    Precompute the per-date pieces (doy, 2-digit year, URL prefix, local day
+    directory) shared by every station's candidates on that date. Computing
+    these once per date instead of once per (station, date) removes the
+    timetuple()/format work from the fan-out hot path.
     """
-    st_low = station.lower()
-    st_up = station.upper()
     year = current_date.year
     doy = current_date.timetuple().tm_yday
     yy = year % 100
+    url_prefix = f"https://gage-data.earthscope.org/archive/gnss/rinex/obs/{year}/{doy:03d}/"
+    base_dir = os.path.join(rinex_root, f"{year}", f"{doy:03d}")
+    return doy, yy, url_prefix, base_dir
+
+# Station code casings are static across the whole sweep; compute them once
+# per station instead of lowering/uppering and dedup'ing per (station, date).
+_station_prefixes = {}
+
+def generate_candidate_filenames(station: str, doy: int, yy: int):
+    """
+    Return a list of possible RINEX filenames to try for station/date.
+    Includes lowercase and uppercase station codes (one entry when the
+    station code has no letters to case-fold).
+    """
+    prefixes = _station_prefixes.get(station)
+    if prefixes is None:
+        st_low = station.lower()
+        st_up = station.upper()
+        prefixes = (st_low,) if st_low == st_up else (st_low, st_up)
+        _station_prefixes[station] = prefixes
     # pattern: <station><DOY>00.<yy>d.Z
-    patterns = [
-        f"{st_low}{doy:03d}00.{yy:02d}d.Z",
-        f"{st_up}{doy:03d}00.{yy:02d}d.Z",
-    ]
-    # remove duplicates
-    seen = set(); unique = []
-    for p in patterns:
-        if p not in seen:
-            seen.add(p); unique.append(p)
-    return unique
-
-def generate_rinex_url_and_path(station: str, current_date: date, rinex_root: str):
+    suffix = "%03d00.%02dd.Z" % (doy, yy)
+    return [p + suffix for p in prefixes]
+
+def generate_rinex_url_and_path(station: str, date_info):
     """
-    Given station and date, generate list of (url, local_path) candidates.
+    Given station and a precomputed date_info tuple, generate list of
+    (url, local_path) candidates.
     """
-    year = current_date.year
-    doy = current_date.timetuple().tm_yday
-    base_dir = os.path.join(rinex_root, f"{year}", f"{doy:03d}")
+    doy, yy, url_prefix, base_dir = date_info
     candidates = []
-    for fname in generate_candidate_filenames(station, current_date):
-        url = f"https://gage-data.earthscope.org/archive/gnss/rinex/obs/{year}/{doy:03d}/{fname}"
-        local_path = os.path.join(base_dir, fname)
-        candidates.append((url, local_path))
+    for fname in generate_candidate_filenames(station, doy, yy):
+        candidates.append((url_prefix + fname, os.path.join(base_dir, fname)))
     return candidates
 
-def ensure_directory(path: str):
-    dirpath = os.path.dirname(path)
-    if not os.path.exists(dirpath):
-        try:
-            os.makedirs(dirpath, exist_ok=True)
-            logger.debug(f"Created directory: {dirpath}")
-        except Exception as e:
-            logger.error(f"Failed to create directory {dirpath}: {e}")
-            raise
+class _WriterThread:
+    """
+    Single daemon thread draining a queue of (path, payload) writes.
+    The event loop only enqueues -- no per-write thread dispatch or executor
+    round-trip on the hot path. Write errors are logged, not raised; close()
+    drains the queue so all files are on disk before the batch summary.
+    """
+    _SENTINEL = object()
 
-def download_file(url: str, local_path: str, token: str, max_retries=MAX_RETRIES) -> bool:
-    headers = {
-        "Authorization": f"Bearer {token}",
-        "User-Agent": USER_AGENT,
-    }
+    def __init__(self):
+        self._q = queue.Queue()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._q.get()
+            if item is self._SENTINEL:
+                return
+            path, payload = item
+            try:
+                # One open/write/close per file; RINEX day files are small
+                # enough to buffer whole.
+                with open(path, "wb") as f:
+                    f.write(payload)
+            except Exception as e:
+                logger.error(f"Write failed for {path}: {e}")
+
+    def submit(self, path: str, payload: bytes):
+        self._q.put((path, payload))
+
+    def close(self):
+        self._q.put(self._SENTINEL)
+        self._thread.join()
+
+# Set for the duration of a batch run by _download_rinex_batch_async
+_writer = None
+
+async def download_file(client: httpx.AsyncClient, url: str, local_path: str,
+                        max_retries=MAX_RETRIES):
+    """
+    Tri-state result: True on success, False only on a definitive 404, and
+    None for everything else (timeouts, 5xx after retries, auth/4xx oddities).
+    Only False outcomes are safe to record in the persistent miss cache; None
+    means "unknown this run", so the station-day stays eligible for retry.
+    """
     for attempt in range(1, max_retries + 1):
         try:
-            with requests.get(url, headers=headers, stream=True, timeout=HTTP_TIMEOUT) as resp:
+            async with client.stream("GET", url) as resp:
                 if resp.status_code == 200:
-                    ensure_directory(local_path)
-                    with open(local_path, "wb") as f:
-                        for chunk in resp.iter_content(chunk_size=8192):
-                            if chunk:
-                                f.write(chunk)
+                    # aiter_raw skips content decoding (the payloads are
+                    # already Hatanaka/.Z compressed) and 1 MiB chunks mean
+                    # most files arrive in a single Python-level iteration
+                    chunks = []
+                    async for chunk in resp.aiter_raw(1 << 20):
+                        chunks.append(chunk)
+                    _writer.submit(local_path, b"".join(chunks))
                     logger.info(f"Downloaded: {url}")
                     return True
                 elif resp.status_code == 404:
@@ -214,42 +249,142 @@ def download_file(url: str, local_path: str, token: str, max_retries=MAX_RETRIES
                 else:
                     logger.warning(f"Unexpected status {resp.status_code} for URL: {url}")
                     if 500 <= resp.status_code < 600:
-                        raise requests.HTTPError(f"Server error {resp.status_code}")
+                        raise httpx.HTTPStatusError(f"Server error {resp.status_code}",
+                                                    request=resp.request, response=resp)
                     else:
-                        return False
+                        return None
         except Exception as e:
             logger.warning(f"Attempt {attempt} failed for {url}: {e}")
             if attempt < max_retries:
-                logger.info(f"Retrying after {RETRY_BACKOFF_SEC} seconds...")
-                import time; time.sleep(RETRY_BACKOFF_SEC)
+                backoff = RETRY_BACKOFF_SEC * 2 ** (attempt - 1)
+                logger.info(f"Retrying after {backoff} seconds...")
+                await asyncio.sleep(backoff)
             else:
                 logger.error(f"All {MAX_RETRIES} attempts failed for {url}")
-                return False
+                return None
 
-def download_for_date_station(station: str, current_date: date, token: str, rinex_root: str, dry_run=False):
+# Remembers which candidate index (lowercase vs uppercase filename) last
+# succeeded per station, so subsequent dates skip the HEAD probe entirely.
+_station_case_cache = {}
+
+async def _probe_candidates(client: httpx.AsyncClient, candidates):
+    """
+    HEAD all candidate URLs concurrently. Returns (index, all_404): the index
+    of the first 200 (or None), and whether every probe came back an actual
+    404. Errored probes (exceptions, 405, 5xx) say nothing about whether the
+    file exists, so they clear all_404 rather than counting as misses.
+    """
+    responses = await asyncio.gather(
+        *(client.head(url) for url, _ in candidates),
+        return_exceptions=True)
+    winner = None
+    all_404 = True
+    for i, resp in enumerate(responses):
+        if isinstance(resp, httpx.Response) and resp.status_code == 200:
+            if winner is None:
+                winner = i
+            all_404 = False
+        elif not (isinstance(resp, httpx.Response) and resp.status_code == 404):
+            all_404 = False
+    return winner, all_404
+
+async def download_for_date_station(client: httpx.AsyncClient, station: str, current_date: date,
+                                    date_info, dry_run=False):
     """
     Attempt to download RINEX for station/date, trying multiple filename patterns.
-    Returns (local_path, success_flag).
+    Instead of GETting the variants serially (a wasted 404 round-trip whenever
+    the uppercase name is canonical), HEAD-probe them concurrently and GET only
+    the winner, remembering the winning case per station.
+    Returns (local_path, success_flag, missing_flag); missing is True only
+    when every variant came back a definitive 404, never for transient
+    failures (timeouts, 5xx, auth), so only genuine misses reach the cache.
     """
-    candidates = generate_rinex_url_and_path(station, current_date, rinex_root)
+    candidates = generate_rinex_url_and_path(station, date_info)
     if dry_run:
         for url, local_path in candidates:
             logger.info(f"[DRY RUN] Would try: {url}")
-        return candidates[0][1], True
-
-    for url, local_path in candidates:
-        if os.path.isfile(local_path) and os.path.getsize(local_path) > 0:
-            logger.debug(f"Already exists, skipping: {local_path}")
-            return local_path, True
-        success = download_file(url, local_path, token)
-        if success:
-            return local_path, True
+        return candidates[0][1], True, False
+
+    if len(candidates) == 1:
+        url, local_path = candidates[0]
+        got = await download_file(client, url, local_path)
+        if got:
+            return local_path, True, False
+        return local_path, False, got is False
+
+    # Try the case that worked for this station last time, if known
+    preferred = _station_case_cache.get(station)
+    if preferred is not None:
+        url, local_path = candidates[preferred]
+        if await download_file(client, url, local_path):
+            return local_path, True, False
+        _station_case_cache.pop(station, None)
+
+    idx, all_404 = await _probe_candidates(client, candidates)
+    if idx is not None:
+        url, local_path = candidates[idx]
+        if await download_file(client, url, local_path):
+            _station_case_cache[station] = idx
+            return local_path, True, False
+        # The probe saw the file but the GET did not come through: transient
+        all_404 = False
     logger.debug(f"All filename variants failed for station {station} date {current_date}")
-    return candidates[0][1], False
+    return candidates[0][1], False, all_404
+
+async def _download_rinex_batch_async(task_iter, token, date_info, max_workers,
+                                      dry_run, on_result):
+    """
+    Drive all (station, date) downloads over one pooled HTTP/2 client.
+    Sharing the client keeps TLS sessions and keep-alive connections warm and
+    auth headers are configured once on the client rather than rebuilt per
+    request. Tasks are pulled lazily from task_iter through a bounded window
+    (max_workers * 4 in-flight), so peak memory stays O(workers) rather than
+    O(total station-days); the connection pool caps sockets at max_workers.
+    Each completed task is handed to on_result instead of accumulating.
+    """
+    limits = httpx.Limits(max_connections=max_workers,
+                          max_keepalive_connections=max_workers)
 
-def daterange(start_date: date, end_date: date):
-    for n in range((end_date - start_date).days + 1):
-        yield start_date + timedelta(n)
+    async def _one(st, dt):
+        try:
+            local_path, success, missing = await download_for_date_station(
+                client, st, dt, date_info[dt], dry_run)
+            if not success:
+                logger.debug(f"Failed: station {st}, date {dt.isoformat()}")
+            return (st, dt, local_path, success, missing)
+        except Exception as e:
+            logger.error(f"Exception for station {st}, date {dt}: {e}")
+            return (st, dt, None, False, False)
+
+    headers = {
+        "Authorization": f"Bearer {token}",
+        "User-Agent": USER_AGENT,
+    }
+    window = max_workers * 4
+    global _writer
+    _writer = _WriterThread()
+    try:
+        async with httpx.AsyncClient(headers=headers, http2=True, limits=limits,
+                                     timeout=HTTP_TIMEOUT) as client:
+            it = iter(task_iter)
+            pending = set()
+            exhausted = False
+            while True:
+                while not exhausted and len(pending) < window:
+                    try:
+                        st, dt = next(it)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    pending.add(asyncio.ensure_future(_one(st, dt)))
+                if not pending:
+                    break
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    on_result(task.result())
+    finally:
+        _writer.close()
+        _writer = None
 
 def download_rinex_batch(stations, start_date: date, end_date: date, out_root: str,
                          station_periods: dict,
@@ -258,7 +393,15 @@ def download_rinex_batch(stations, start_date: date, end_date: date, out_root: s
     Download RINEX files for stations over date range, limited by each station's operational period.
     """
     token = get_bearer_token()
-    tasks = []
+
+    # Negative-result cache: station-days that failed on every filename
+    # variant in a previous run are skipped without any HTTP work on reruns.
+    os.makedirs(out_root, exist_ok=True)
+    cache_db = sqlite3.connect(os.path.join(out_root, ".rinex_cache.sqlite"))
+    cache_db.execute("CREATE TABLE IF NOT EXISTS miss (st TEXT, d TEXT, PRIMARY KEY(st, d))")
+    known_missing = set(cache_db.execute("SELECT st, d FROM miss"))
+
+    windows = []
     for st in stations:
         st_start, st_stop = station_periods.get(st, (None, None))
         eff_start = start_date
@@ -270,34 +413,124 @@ def download_rinex_batch(stations, start_date: date, end_date: date, out_root: s
         if eff_end < eff_start:
             logger.info(f"Skipping station {st}: no overlap with date range")
             continue
-        for single_date in daterange(eff_start, eff_end):
-            tasks.append((st, single_date))
-    total = len(tasks)
-    logger.info(f"Starting download: {len(stations)} stations, {total} station-days, out_root={out_root}, workers={max_workers}")
-
-    results = []
-    lock = threading.Lock()
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        future_to_task = {
-            executor.submit(download_for_date_station, st, dt, token, out_root, dry_run): (st, dt)
-            for (st, dt) in tasks
-        }
-        for future in as_completed(future_to_task):
-            st, dt = future_to_task[future]
+        windows.append((st, eff_start, eff_end))
+
+    if not windows:
+        logger.info("No stations overlap the requested date range")
+        cache_db.close()
+        return 0, 0
+
+    # Decode each calendar day in the overall span exactly once; per-station
+    # expansion then slices this shared table instead of redoing timedelta
+    # arithmetic for every (station, day) pair.
+    lo = min(d0 for _, d0, _ in windows).toordinal()
+    hi = max(d1 for _, _, d1 in windows).toordinal()
+    span_dates = [date.fromordinal(o) for o in range(lo, hi + 1)]
+
+    counters = {"cached": 0, "done": 0, "success": 0}
+    win_ords = [(st, d0.toordinal(), d1.toordinal()) for st, d0, d1 in windows]
+
+    def iter_tasks():
+        # Lazily expand (station, date) pairs so the full cross product is
+        # never materialized; the scheduler pulls from this as slots free up.
+        # Date-major order keeps consecutive requests on the same <year>/<doy>
+        # server path, so keep-alive connections and TLS session state stay
+        # warm instead of hopping across two decades of URLs per station.
+        for i, single_date in enumerate(span_dates):
+            o = lo + i
+            day_key = single_date.isoformat()
+            for st, o0, o1 in win_ords:
+                if o0 <= o <= o1:
+                    if not dry_run:
+                        if (st, day_key) in known_missing:
+                            counters["cached"] += 1
+                            continue
+                        present = find_present(st, single_date)
+                        if present is not None:
+                            # Already on disk: record synchronously, no
+                            # scheduler/future overhead for the common
+                            # incremental-rerun case
+                            on_result((st, single_date, present, True, False))
+                            continue
+                    yield st, single_date
+
+    def find_present(st, dt):
+        names = existing[dt]
+        if not names:
+            return None
+        doy, yy, _, base_dir = date_info[dt]
+        for fname in generate_candidate_filenames(st, doy, yy):
+            if fname in names:
+                return os.path.join(base_dir, fname)
+        return None
+
+    total_days = sum((d1 - d0).days + 1 for _, d0, d1 in windows)
+    logger.info(f"Starting download: {len(stations)} stations, up to {total_days} station-days, out_root={out_root}, workers={max_workers}")
+
+    # Per-date URL/path pieces computed once per unique covered date, not per
+    # task; coverage is marked with one vectorized slice-assign per station
+    covered = np.zeros(hi - lo + 1, dtype=bool)
+    for _, d0, d1 in windows:
+        covered[d0.toordinal() - lo : d1.toordinal() - lo + 1] = True
+    date_info = {span_dates[i]: make_date_info(span_dates[i], out_root)
+                 for i in np.flatnonzero(covered)}
+
+    # Create each <year>/<doy> directory once up front; doing it inside the
+    # download path re-stats the same directory for every station.
+    if not dry_run:
+        for _, _, _, base_dir in date_info.values():
+            os.makedirs(base_dir, exist_ok=True)
+
+    # One scandir per day directory replaces two stat syscalls per candidate
+    # filename; existence checks become set lookups.
+    existing = {dt: set() for dt in date_info}
+    if not dry_run:
+        for dt, (_, _, _, base_dir) in date_info.items():
+            names = existing[dt]
             try:
-                local_path, success = future.result()
-                if not success:
-                    logger.debug(f"Failed: station {st}, date {dt.isoformat()}")
-                with lock:
-                    results.append((st, dt, local_path, success))
-            except Exception as e:
-                logger.error(f"Exception for station {st}, date {dt}: {e}")
-                with lock:
-                    results.append((st, dt, None, False))
-    n_success = sum(1 for r in results if r[3])
-    n_fail = total - n_success
-    logger.info(f"Download complete: {n_success} succeeded, {n_fail} failed or missing")
-    return results
+                with os.scandir(base_dir) as it:
+                    for entry in it:
+                        if entry.is_file() and entry.stat().st_size > 0:
+                            names.add(entry.name)
+            except FileNotFoundError:
+                pass
+
+    # Stream per-task outcomes to a manifest on disk instead of growing an
+    # in-memory results list across the whole sweep
+    manifest_path = os.path.join(out_root, "download_manifest.csv")
+    new_misses = []
+    with open(manifest_path, "w", newline="") as mf:
+        manifest = csv.writer(mf)
+        manifest.writerow(["station", "date", "local_path", "success"])
+
+        def on_result(result):
+            st, dt, local_path, success, missing = result
+            manifest.writerow([st, dt.isoformat(), local_path or "", int(success)])
+            counters["done"] += 1
+            if success:
+                counters["success"] += 1
+            elif missing:
+                # Terminal miss: every filename variant returned a real 404.
+                # Transient failures (timeouts, 5xx, auth) never set missing,
+                # so they stay eligible for retry next run.
+                new_misses.append((st, dt.isoformat()))
+            if counters["done"] % 1000 == 0:
+                logger.info(f"Progress: {counters['done']} station-days processed")
+
+        asyncio.run(_download_rinex_batch_async(iter_tasks(), token, date_info,
+                                                max_workers, dry_run, on_result))
+
+    if counters["cached"]:
+        logger.info(f"Skipped {counters['cached']} station-days known missing from previous runs")
+    if not dry_run and new_misses:
+        with cache_db:
+            cache_db.executemany("INSERT OR IGNORE INTO miss VALUES (?, ?)", new_misses)
+    cache_db.close()
+
+    n_success = counters["success"]
+    n_fail = counters["done"] - n_success
+    logger.info(f"Download complete: {n_success} succeeded, {n_fail} failed or missing; manifest at {manifest_path}")
+    return n_success, n_fail
 
 # ========== Main ==========
 if __name__ == "__main__":
@@ -332,14 +565,14 @@ if __name__ == "__main__":
 
     # Query metadata for bounding box
     logger.info(f"Querying station metadata for bbox lat[{args.min_lat},{args.max_lat}], lon[{args.min_lon},{args.max_lon}]")
-    df_meta = query_metadata_bbox(args.min_lat, args.max_lat, args.min_lon, args.max_lon)
-    if df_meta.empty:
+    station_records = query_metadata_bbox(args.min_lat, args.max_lat, args.min_lon, args.max_lon)
+    if not station_records:
         logger.error("No stations found in bounding box.")
         sys.exit(1)
-    #logger.info(f"Found {len(df_meta)} stations in bounding box.")
+    #logger.info(f"Found {len(station_records)} stations in bounding box.")
 
     # Parse station periods
-    station_periods = parse_session_periods(df_meta)
+    station_periods = parse_session_periods(station_records)
 
     # Determine station list
     if args.stations_file:
@@ -1,8 +1,9 @@
 import sys
 import numpy as np
 
-import sys
-import numpy as np
+# Generator API: choice(..., shuffle=False) skips the legacy full
+# Fisher-Yates pass over an N-length index array per invocation
+_RNG = np.random.default_rng()
 
 def filter_local_percentile(ins, outs):
     """
@@ -22,24 +23,30 @@ def filter_local_percentile(ins, outs):
         # PDAL’s Python subprocess will appear to “freeze” while that runs
         N_sample = 10_000
         if len(z) > N_sample:
-            indices = np.random.choice(len(z), size=N_sample, replace=False)
+            indices = _RNG.choice(len(z), size=N_sample, replace=False, shuffle=False)
             sample = z[indices]
         else:
             sample = z
 
-        # Estimate cutoff on sample
-        cutoff = np.percentile(sample, thr * 100)
+        # Estimate cutoff on sample via introselect: O(n) instead of the
+        # full O(n log n) sort np.percentile would do for one quantile;
+        # fp32 is plenty of precision for elevation cutoffs
+        sample = sample[~np.isnan(sample)].astype(np.float32, copy=False)
+        k = int(thr * (sample.size - 1))
+        cutoff = np.partition(sample, k)[k]
 
         # 3Apply to full array
         mask = z >= cutoff
 
-        # Copy all dimensions by dict keys (ins is a dict of arrays)
+        # Decode the boolean mask once; per-field arr[mask] would rescan all
+        # N mask bits for every dimension of the cloud
+        idx = np.flatnonzero(mask)
         for field, arr in ins.items():
-            outs[field] = arr[mask]
+            outs[field] = arr.take(idx)
 
         sys.stderr.write(
             f"[filter_local_pct] thr={thr}, cutoff={cutoff:.2f}, "
-            f"orig={len(z)}, kept={mask.sum()}\n"
+            f"orig={len(z)}, kept={idx.size}\n"
         )
         return True
 
@@ -48,4 +55,3 @@ def filter_local_percentile(ins, outs):
         import traceback
         traceback.print_exc(file=sys.stderr)
         raise
-
@@ -1,6 +1,50 @@
 import sys
 import numpy as np
 import scipy.stats as stats
+from numba import njit, prange
+
+@njit(parallel=True, fastmath={"reassoc", "contract", "arcp"}, cache=True)
+def _mean_std_nan(z):
+    """
+    Single-pass NaN-aware mean/std via parallel moment reduction.
+    Replaces the separate np.nanmean + np.nanstd scans over Z.
+    Only the safe fastmath subset is enabled: full fastmath asserts nnan,
+    which licenses LLVM to fold the np.isnan guard to False and lets NaNs
+    poison the moments. reassoc is what the parallel reduction needs.
+    """
+    n = 0
+    s = 0.0
+    ss = 0.0
+    for i in prange(z.size):
+        v = z[i]
+        if not np.isnan(v):
+            n += 1
+            s += v
+            ss += v * v
+    if n == 0:
+        return np.nan, np.nan
+    m = s / n
+    var = ss / n - m * m
+    if var < 0.0:
+        var = 0.0
+    return m, np.sqrt(var)
+
+@njit(parallel=True, cache=True)
+def _apply(z, cls, z_val, m, s, out):
+    """
+    Fused Z-score + reclassification: flags Z outliers as class 18 without
+    materializing the intermediate zs array. NaN Z keeps its original class,
+    matching the old np.where behavior. Returns the flagged count so the
+    log line does not need its own O(N) pass.
+    """
+    flagged = 0
+    for i in prange(z.size):
+        if (z[i] - m) / s > z_val:
+            out[i] = 18
+            flagged += 1
+        else:
+            out[i] = cls[i]
+    return flagged
 
 def filter_percentile(ins, outs):
     """
@@ -13,18 +57,28 @@ def filter_percentile(ins, outs):
         thr = float(pdalargs.get("percentile_threshold", 0.95))
         z_val = stats.norm.ppf(thr)
 
-        z = ins["Z"]
-        m = np.nanmean(z)
-        s = np.nanstd(z)
-        zs = (z - m) / s
+        # fp32 halves the bytes streamed through the memory-bound kernels;
+        # elevation ranges are well within float32 precision
+        z = np.ascontiguousarray(ins["Z"], dtype=np.float32)
+        cls = ins["Classification"]
+        m, s = _mean_std_nan(z)
 
-        newclass = np.where(zs > z_val, 18, ins["Classification"])
-        outs["Classification"] = newclass
+        if not s > 0.0:
+            # Constant or all-NaN Z: no spread means no outliers, and the
+            # kernel's (z - m) / s would raise ZeroDivisionError under
+            # numba's python error model (the old numpy path produced
+            # inf/nan and completed). Pass classifications through.
+            outs["Classification"] = cls
+            flagged = 0
+        else:
+            newclass = np.empty_like(cls)
+            flagged = _apply(z, cls, np.float32(z_val), np.float32(m), np.float32(s), newclass)
+            outs["Classification"] = newclass
 
         # Debug print to stderr
         sys.stderr.write(
             f"[filter_percentile] thr={thr}, z_val={z_val:.2f}, "
-            f"orig={len(z)}, kept={(zs <= z_val).sum()}\n"
+            f"orig={len(z)}, kept={len(z) - int(flagged)}\n"
         )
         return True
 
@@ -40,36 +40,89 @@ p = pdal.Pipeline(json.dumps({"pipeline": pipeline}))
 p.execute()
 ```
 """
+import concurrent.futures
+import functools
 import json
 import os
+import weakref
+import numpy as np
 import pdal
+import shapely
 from pyproj import CRS, Transformer
 
 
+# -----------------------------------------------------------------------------
+# 0) Cached pyproj constructors
+#    CRS parsing and Transformer construction go through PROJ and cost tens of
+#    milliseconds each; identical WKTs/EPSGs recur for every tile in a batch,
+#    so all call sites below go through these memoized accessors.
+# -----------------------------------------------------------------------------
+@functools.lru_cache(maxsize=256)
+def _crs_from_wkt(wkt):
+    return CRS.from_wkt(wkt)
+
+
+@functools.lru_cache(maxsize=256)
+def _crs_from_epsg(epsg):
+    return CRS.from_epsg(epsg)
+
+
+@functools.lru_cache(maxsize=256)
+def _transformer_to_epsg(src_wkt, dst_epsg):
+    return Transformer.from_crs(_crs_from_wkt(src_wkt), _crs_from_epsg(dst_epsg),
+                                always_xy=True)
+
+
+@functools.lru_cache(maxsize=256)
+def _crs_equal(wkt_a, wkt_b):
+    """Deep PROJ equality, cached per WKT pair (CRS.equals is expensive)."""
+    return _crs_from_wkt(wkt_a).equals(_crs_from_wkt(wkt_b))
+
+
+@functools.lru_cache(maxsize=128)
+def _horiz_epsg(wkt):
+    """EPSG of the horizontal component of a (possibly compound) CRS WKT.
+    sub_crs_list and to_epsg each go back into PROJ, so cache the result."""
+    c = _crs_from_wkt(wkt)
+    return (c.sub_crs_list[0] if c.is_compound else c).to_epsg()
+
+
 # -----------------------------------------------------------------------------
 # 1) CRS Detection Functions
 # -----------------------------------------------------------------------------
-def detect_input_crs_wkt(laz_path):
+@functools.lru_cache(maxsize=256)
+def _read_header(laz_path, mtime):
     """
-    Reads the spatial reference WKT from a .laz LAS/LAZ dataset using PDAL metadata.
-    Returns a WKT string of the input CRS.
+    Header-only metadata read via quickinfo: decodes the LAS header/VLRs
+    without materializing any points, unlike pipeline.execute() which loads
+    the whole cloud just to expose metadata. Returns (wkt, bbox) where bbox
+    is (minx, maxx, miny, maxy). mtime is part of the cache key so a
+    rewritten file invalidates its stale entry; use _header() below.
     """
-    # Minimal pipeline to read header metadata
-    pipeline_json = {"pipeline": [{"type": "readers.las", "filename": laz_path}]}
-    pipeline = pdal.Pipeline(json.dumps(pipeline_json))
-    pipeline.execute()
+    pipeline = pdal.Pipeline(json.dumps(
+        {"pipeline": [{"type": "readers.las", "filename": laz_path}]}))
+    info = pipeline.quickinfo['readers.las']
+
+    srs = info.get('srs', {})
+    # Prefer the compound WKT (horizontal + vertical), fall back to plain WKT
+    wkt = srs.get('compoundwkt') or srs.get('wkt') or ''
+    b = info['bounds']
+    return wkt, (b['minx'], b['maxx'], b['miny'], b['maxy'])
 
-    # Extract PDAL reader metadata
-    md = pipeline.metadata['metadata']['readers.las']
 
-    # Prefer direct 'spatialreference' WKT
-    if 'spatialreference' in md and md['spatialreference']:
-        return md['spatialreference']
-    # Otherwise fallback to compound WKT under 'srs'
-    if 'srs' in md and 'compoundwkt' in md['srs']:
-        return md['srs']['compoundwkt']
+def _header(laz_path):
+    return _read_header(laz_path, os.path.getmtime(laz_path))
 
-    raise ValueError(f"No valid SRS WKT found in PDAL metadata for: {laz_path}")
+
+def detect_input_crs_wkt(laz_path):
+    """
+    Reads the spatial reference WKT from a .laz LAS/LAZ dataset using PDAL metadata.
+    Returns a WKT string of the input CRS.
+    """
+    wkt, _ = _header(laz_path)
+    if not wkt:
+        raise ValueError(f"No valid SRS WKT found in PDAL metadata for: {laz_path}")
+    return wkt
 
 
 def find_longitude_of_origin_from_utm(epsg_code):
@@ -81,11 +134,40 @@ def find_longitude_of_origin_from_utm(epsg_code):
     return (zone - 1) * 6 - 180 + 3
 
 
+@functools.lru_cache(maxsize=1)
+def _load_base_wkt(path):
+    with open(path, 'r') as f:
+        return f.read()
+
+
+@functools.lru_cache(maxsize=128)
+def _g2139_zone_wkt(base_utm_wkt_path, epsg_code):
+    """
+    Render the G2139 compound WKT for one UTM zone from the base template.
+    There are only 120 UTM zones, so maxsize=128 saturates the cache and the
+    string replaces run at most once per zone per process, however many
+    adjacent tiles share that zone.
+    """
+    base_wkt = _load_base_wkt(base_utm_wkt_path)
+    zone = epsg_code % 100
+    north = epsg_code < 32700
+    zone_str = f"{zone}{'N' if north else 'S'}"
+    base_wkt = base_wkt.replace("UTM 10N", f"UTM {zone_str}")
+    base_wkt = base_wkt.replace("UTM zone 10N", f"UTM zone {zone_str}")
+    # Replace default lon of origin (e.g. -123) with computed
+    center_long = find_longitude_of_origin_from_utm(epsg_code)
+    return base_wkt.replace('"Longitude of natural origin",-123',
+                            f'"Longitude of natural origin",{center_long}')
+
+
 def detect_output_utm_crs_g2139_wkt(laz_path, base_utm_wkt_path):
     """
     Auto-detects UTM zone from LAZ centroid and builds a WGS84 G2139-based 3D compound CRS.
-    Reads a base WKT file (for a specific zone) then replaces zone string and central meridian,
-    writes new WKT to /tmp/UTM_<zone>_WGS84_G2139_3D.wkt, and returns that path.
+    Reads a base WKT file (for a specific zone), replaces the zone string and
+    central meridian, and returns the resulting WKT string directly --
+    create_pdal_pipeline accepts WKT or a path, so nothing round-trips
+    through /tmp anymore (which also removes a race between parallel
+    workers landing on the same zone).
 
     Parameters:
     - laz_path: input LAZ file for centroid-based zone detection
@@ -94,19 +176,15 @@ def detect_output_utm_crs_g2139_wkt(laz_path, base_utm_wkt_path):
     Credit to Shashank Bhushan's 
     https://github.com/uw-cryo/wv_stereo_processing/blob/fbd1fcadf7e81b75b506e2e66d3f817eea568d09/scripts/csm_proc/produce_colocated_dem_ortho_large_clouds.py#L294
     """
-    # 1) Read header to get bounding box
-    p_json = {"pipeline": [{"type": "readers.las", "filename": laz_path}]}
-    p = pdal.Pipeline(json.dumps(p_json))
-    p.execute()
-    md = p.metadata['metadata']['readers.las']
-    minx, maxx = md['minx'], md['maxx']
-    miny, maxy = md['miny'], md['maxy']
+    # 1) Read header (one cached quickinfo pass gives both SRS and bbox)
+    inp_wkt, (minx, maxx, miny, maxy) = _header(laz_path)
+    if not inp_wkt:
+        raise ValueError(f"No valid SRS WKT found in PDAL metadata for: {laz_path}")
     # centroid in native CRS
     cx, cy = (minx + maxx) / 2.0, (miny + maxy) / 2.0
 
     # 2) Transform centroid to geographic (EPSG:4326)
-    inp_wkt = detect_input_crs_wkt(laz_path)
-    transformer = Transformer.from_crs(CRS.from_wkt(inp_wkt), CRS.from_epsg(4326), always_xy=True)
+    transformer = _transformer_to_epsg(inp_wkt, 4326)
     lon, lat = transformer.transform(cx, cy)
 
     # 3) Determine UTM zone and EPSG
@@ -114,25 +192,37 @@ def detect_output_utm_crs_g2139_wkt(laz_path, base_utm_wkt_path):
     north = lat >= 0
     epsg_code = 32600 + zone if north else 32700 + zone
 
-    # 4) Read base WKT template
-    with open(base_utm_wkt_path, 'r') as f:
-        base_wkt = f.read()
+    # 4) Render (or fetch the cached) zone WKT from the base template
+    return _g2139_zone_wkt(base_utm_wkt_path, epsg_code)
 
-    # 5) Modify zone text and central meridian
-    zone_str = f"{zone}{'N' if north else 'S'}"
-    base_wkt = base_wkt.replace("UTM 10N", f"UTM {zone_str}")
-    base_wkt = base_wkt.replace("UTM zone 10N", f"UTM zone {zone_str}")
-    # Replace default lon of origin (e.g. -123) with computed
-    center_long = find_longitude_of_origin_from_utm(epsg_code)
-    base_wkt = base_wkt.replace('"Longitude of natural origin",-123',
-                                f'"Longitude of natural origin",{center_long}')
 
-    # 6) Write new WKT to /tmp
-    outfn = f"/tmp/UTM_{zone_str}_WGS84_G2139_3D.wkt"
-    with open(outfn, 'w') as f:
-        f.write(base_wkt)
+def detect_output_utm_crs_g2139_wkt_batch(laz_paths, base_utm_wkt_path):
+    """
+    Batch variant of detect_output_utm_crs_g2139_wkt for a directory of tiles.
+    Collects every tile's centroid from the cached header reads, groups tiles
+    by input CRS, and transforms each group's centroids with a single
+    vectorized Transformer.transform call -- PROJ's per-call setup dominates
+    single-point transforms, so one array call replaces N scalar ones.
 
-    return outfn
+    Returns dict {laz_path: compound WKT string}.
+    """
+    by_crs = {}
+    for path in laz_paths:
+        wkt, (minx, maxx, miny, maxy) = _header(path)
+        if not wkt:
+            raise ValueError(f"No valid SRS WKT found in PDAL metadata for: {path}")
+        by_crs.setdefault(wkt, []).append((path, (minx + maxx) / 2.0, (miny + maxy) / 2.0))
+
+    out = {}
+    for inp_wkt, tiles in by_crs.items():
+        transformer = _transformer_to_epsg(inp_wkt, 4326)
+        lons, lats = transformer.transform(np.array([cx for _, cx, _ in tiles]),
+                                           np.array([cy for _, _, cy in tiles]))
+        for (path, _, _), lon, lat in zip(tiles, lons, lats):
+            zone = int((lon + 180) / 6) + 1
+            epsg_code = 32600 + zone if lat >= 0 else 32700 + zone
+            out[path] = _g2139_zone_wkt(base_utm_wkt_path, epsg_code)
+    return out
 
 
 # # TODO: fix hardcoded local filepaths, they were inserted for testing
@@ -291,6 +381,193 @@ def detect_output_utm_crs_g2139_wkt(laz_path, base_utm_wkt_path):
 
 #     return pipeline
 
+# Frozen stage templates: every pipeline build used to construct ~10 dict
+# displays with the same string keys, re-hashing each literal per call.
+# Copying a prebuilt template via {**tmpl, ...} reuses the hashed keys and
+# only adds the per-call fields; fully-constant stages are still copied so
+# no two returned pipelines share a mutable dict.
+_ST_READ_COPC = {"type": "readers.copc"}
+_ST_READ_LAS = {"type": "readers.las"}
+_ST_CROP = {"type": "filters.crop"}
+_ST_RESET = {"type": "filters.assign", "value": "Classification = 0"}
+_ST_SMRF = {"type": "filters.smrf",
+            "scalar": 1.2, "slope": 0.2, "threshold": 0.45, "window": 8.0}
+_ST_RETURNS = {"type": "filters.returns"}
+_ST_EXPRESSION = {"type": "filters.expression"}
+_ST_SAMPLE = {"type": "filters.sample"}
+_ST_ELM = {"type": "filters.elm"}
+_ST_ELM_DROP = {"type": "filters.expression", "expression": "Classification != 7"}
+_ST_RADIUS_OUTLIER = {"type": "filters.radiusoutlier", "radius": 2.0, "min_k": 4}
+_ST_STAT_OUTLIER = {"type": "filters.outlier",
+                    "method": "statistical", "multiplier": 3.0, "mean_k": 8}
+_ST_REPROJECT = {"type": "filters.reprojection"}
+_ST_WRITE_LAS = {"type": "writers.las"}
+_ST_ASSIGN = {"type": "filters.assign"}
+_ST_PCT = {"type": "filters.python",
+           "script": "/home/jehayes/Stereotypical_Helens/filter_percentile.py",
+           "module": "filter_percentile",
+           "function": "filter_percentile"}
+_ST_LOCAL_PCT = {"type": "filters.python",
+                 "script": "/home/jehayes/Stereotypical_Helens/filter_local_percentile.py",
+                 "module": "filter_local_percentile",
+                 "function": "filter_local_percentile"}
+
+
+def _build_stages(
+    laz_file,
+    crop_poly,
+    input_wkt,
+    output_wkt,
+    product,
+    filter_low_noise,
+    filter_high_noise,
+    reset_classes,
+    reclassify_ground,
+    group_filter,
+    reproject,
+    save_pointcloud,
+    pointcloud_file,
+    output_type,
+    percentile_filter,
+    percentile_threshold,
+    percentile_zcut,
+    dsm_percentile,
+    streaming,
+    outlier_method,
+    sample_radius,
+    class_counts,
+    is_copc=None,
+):
+    """
+    Shared stage-list assembly for create_pdal_pipeline and the pre-serialized
+    template path below. Takes already-resolved WKTs and crop polygon.
+    is_copc overrides the filename-suffix detection for the template path,
+    where laz_file is a placeholder token with no meaningful suffix.
+    """
+    if is_copc is None:
+        is_copc = laz_file.endswith((".copc", ".copc.laz"))
+    # COPC inputs carry an octree spatial index, so handing readers.copc the
+    # crop polygon lets it decode only the chunks that intersect the AOI --
+    # roughly O(AOI area / tile area) of the work of reading the whole file
+    # and cropping afterwards.
+    if is_copc:
+        stages = [
+            {**_ST_READ_COPC, "filename": laz_file, "polygon": crop_poly},
+        ]
+    else:
+        stages = [
+            {**_ST_READ_LAS, "filename": laz_file},
+            {**_ST_CROP, "polygon": crop_poly},
+        ]
+
+    # Classification filters
+    if reset_classes:
+        stages.append(dict(_ST_RESET))
+        if reclassify_ground:
+            stages.append(dict(_ST_SMRF))
+    else:
+        if group_filter:
+            stages.append({**_ST_RETURNS, "groups": group_filter})
+
+    # Classification predicates fused into one filters.expression: each
+    # stacked filters.range walks the whole point array, so 2-3 separate
+    # noise/ground stages mean 2-3 full passes where one suffices.
+    # A predicate over a class that has zero points is a full O(N) scan for
+    # nothing; with a classification histogram in hand, drop those.
+    def _present(cls):
+        return class_counts is None or class_counts.get(cls, 0) > 0
+
+    predicates = []
+    if not reset_classes:
+        if filter_low_noise and _present(7):
+            predicates.append("Classification != 7")
+        if filter_high_noise and _present(18):
+            predicates.append("Classification != 18")
+    # DTM only: keep ground
+    if product == "dtm":
+        predicates.append("Classification == 2")
+    if predicates:
+        stages.append({**_ST_EXPRESSION, "expression": " && ".join(predicates)})
+
+    # Optional Poisson-disk thinning before the neighborhood-based stages:
+    # the statistical outlier's KD-tree cost drops roughly quadratically
+    # with the retained fraction, and at >=1m DSM resolution a radius of
+    # about resolution/4 loses nothing the gridder would have kept.
+    if sample_radius is not None:
+        stages.append({**_ST_SAMPLE, "radius": float(sample_radius)})
+
+    # Outlier removal (always). ELM (Extended Local Minimum) is linear and
+    # streamable; the statistical method builds a KD-tree over the entire
+    # cloud with 8-NN queries per point -- O(N log N) with large constants
+    # and the stage that dominated pipeline wall time on big tiles -- so it
+    # is opt-in. In streaming mode a statistical request degrades to the
+    # stream-compatible radius variant.
+    if outlier_method == "elm":
+        # ELM flags low outliers as class 7 rather than dropping them
+        stages.append(dict(_ST_ELM))
+        stages.append(dict(_ST_ELM_DROP))
+    elif streaming:
+        stages.append(dict(_ST_RADIUS_OUTLIER))
+    else:
+        stages.append(dict(_ST_STAT_OUTLIER))
+
+    # Reprojection; byte-identical WKT skips the deep PROJ equality test
+    if reproject and input_wkt != output_wkt and not _crs_equal(input_wkt, output_wkt):
+        stages.append({**_ST_REPROJECT, "in_srs": input_wkt, "out_srs": output_wkt})
+
+    # Optional save
+    if save_pointcloud:
+        writer = {**_ST_WRITE_LAS, "filename": f"{pointcloud_file}.{output_type}"}
+        if output_type == "laz":
+            writer.update({
+                "compression": "true",
+                "minor_version": "2",
+                "dataformat_id": "0"
+            })
+        stages.append(writer)
+
+    # Noise‐trim Z outliers. With a precomputed cutoff the reclassification
+    # is a plain threshold, so it runs in PDAL's native filters.assign instead
+    # of hopping every chunk through the Python interpreter; otherwise fall
+    # back to the Numba-jitted filter_percentile.py, which needs the global
+    # mean/std at run time.
+    if percentile_filter:
+        if streaming and percentile_zcut is None:
+            raise ValueError(
+                "streaming=True requires percentile_zcut (the filters.python "
+                "percentile stage is not streamable); precompute the cutoff "
+                "with a filters.stats pre-pass or disable percentile_filter"
+            )
+        if percentile_zcut is not None:
+            stages.append({
+                **_ST_ASSIGN,
+                "value": [f"Classification = 18 WHERE Z > {percentile_zcut}"]
+            })
+        else:
+            stages.append({
+                **_ST_PCT,
+                "pdalargs": {"percentile_threshold": percentile_threshold}
+            })
+
+    # DSM only: canopy‐percentile RH_x. At >= 0.98 the per-cell 'max'
+    # gridder in create_dem_stage already yields the same surface, so the
+    # filters.python stage -- a full Python-held scan over every point --
+    # is only worth its cost for strict RH_x below that.
+    if product == "dsm" and dsm_percentile is not None and dsm_percentile < 0.98:
+        if streaming:
+            raise ValueError(
+                "streaming=True is incompatible with the local DSM "
+                "percentile filters.python stage; use product='dtm' or "
+                "grid with writers.gdal output_type='max' instead"
+            )
+        stages.append({
+            **_ST_LOCAL_PCT,
+            "pdalargs": {"percentile_threshold": dsm_percentile}
+        })
+
+    return stages
+
+
 def create_pdal_pipeline(
     laz_file,
     aoi,                       # GeoDataFrame/GeoSeries in EPSG:4326
@@ -308,108 +585,294 @@ def create_pdal_pipeline(
     output_type="laz",
     percentile_filter=True,
     percentile_threshold=0.95,
-    dsm_percentile=0.98
+    percentile_zcut=None,      # Precomputed Z cutoff -> native assign stage
+    dsm_percentile=0.98,
+    streaming=False,           # Keep every stage stream-compatible
+    outlier_method="elm",      # 'elm' (linear, streamable) or 'statistical'
+    sample_radius=None,        # Poisson-disk thinning radius (m), off by default
+    class_counts=None          # {class: count} histogram, e.g. read_classification_counts()
 ):
     """
     DSM vs. DTM pipeline builder.
     - product='dsm': keep all returns, outlier-trim, then canopy RH_x.
     - product='dtm': isolate ground (class 2), outlier-trim only.
+    - percentile_zcut: absolute Z above which points are flagged as high
+      noise (class 18). Supply it (e.g. from a filters.stats pre-pass as
+      mean + z*std) to swap the filters.python percentile stage for a
+      native filters.assign, which avoids the per-chunk Python round-trip.
+    - streaming: build a fully stream-compatible pipeline so the caller can
+      iterate chunks instead of materializing the whole cloud:
+
+          p = pdal.Pipeline(json.dumps({"pipeline": stages}))
+          for arr in p.iterator(chunk_size=100_000):
+              ...
+
+      Peak RAM drops from O(points) to O(chunk); decompression overlaps
+      filtering. Requires percentile_zcut when percentile_filter is on and
+      swaps the statistical outlier stage for filters.radiusoutlier.
+    - outlier_method: 'elm' runs Extended Local Minimum, a single linear
+      streamable pass; 'statistical' restores the old KD-tree 8-NN stage,
+      which is far slower on >10M-point tiles -- opt in only when its
+      quality is actually needed (consider sampling first, see
+      filters.sample).
+    - sample_radius: when set, a filters.sample (Poisson) stage thins the
+      cloud after the classification filters and before the outlier stage;
+      pointcloud_resolution / 4 is a good value when the target DSM
+      resolution is known.
+    - dsm_percentile: RH_x fraction for the canopy surface. Values >= 0.98
+      (including the default) skip the local-percentile filters.python
+      stage entirely -- grid with create_dem_stage(gridmethod='max'), which
+      produces the same DSM without the Python round-trip.
+    - class_counts: optional classification histogram for this tile (see
+      read_classification_counts). Noise predicates for classes with a
+      zero count are omitted, skipping pointless full-array scans on tiles
+      that were never noise-classified.
     """
     assert input_crs and output_crs
     assert product in ("dsm", "dtm")
 
-    # Load WKT if file paths
-    if os.path.isfile(input_crs):
-        input_wkt = open(input_crs).read()
-    else:
-        input_wkt = input_crs
-    if os.path.isfile(output_crs):
-        output_wkt = open(output_crs).read()
-    else:
-        output_wkt = output_crs
+    input_wkt = _resolve_wkt(input_crs)
+    output_wkt = _resolve_wkt(output_crs)
+    crop_poly = _crop_wkb_hex(aoi, input_wkt)
 
-    # Crop AOI in horizontal CRS
-    comp = CRS.from_wkt(input_wkt)
-    horiz = comp.sub_crs_list[0] if comp.is_compound else comp
-    aoi_m = aoi.to_crs(horiz.to_epsg())
-    crop_wkt = aoi_m.unary_union.wkt
+    return _build_stages(
+        laz_file, crop_poly, input_wkt, output_wkt, product,
+        filter_low_noise, filter_high_noise, reset_classes, reclassify_ground,
+        group_filter, reproject, save_pointcloud, pointcloud_file, output_type,
+        percentile_filter, percentile_threshold, percentile_zcut,
+        dsm_percentile, streaming, outlier_method, sample_radius, class_counts,
+    )
 
-    stages = [
-        {"type": "readers.las", "filename": laz_file},
-        {"type": "filters.crop", "polygon": crop_wkt},
-    ]
 
-    # Classification filters
-    if reset_classes:
-        stages.append({"type": "filters.assign", "value": "Classification = 0"})
-        if reclassify_ground:
-            stages.append({
-                "type": "filters.smrf",
-                "scalar": 1.2, "slope": 0.2, "threshold": 0.45, "window": 8.0
-            })
-    else:
-        if group_filter:
-            stages.append({"type": "filters.returns", "groups": group_filter})
-        if filter_low_noise:
-            stages.append({"type": "filters.range", "limits": "Classification![7:7]"})
-        if filter_high_noise:
-            stages.append({"type": "filters.range", "limits": "Classification![18:18]"})
+# Leading keywords of WKT1/WKT2 CRS strings; anything starting with one of
+# these is obviously not a path, so we can skip the stat syscall entirely.
+_WKT_PREFIXES = ("PROJ", "GEOG", "COMPD", "COMPOUND", "BOUND", "VERT", "GEOCCS")
 
-    # DTM only: keep ground
-    if product == "dtm":
-        stages.append({"type": "filters.range", "limits": "Classification[2:2]"})
-
-    # Statistical outlier (always)
-    stages.append({
-        "type": "filters.outlier",
-        "method": "statistical",
-        "multiplier": 3.0,
-        "mean_k": 8
-    })
-
-    # Reprojection
-    if reproject:
-        in_crs_obj = CRS.from_wkt(input_wkt)
-        out_crs_obj = CRS.from_wkt(output_wkt)
-        if not in_crs_obj.equals(out_crs_obj):
-            stages.append({
-                "type": "filters.reprojection",
-                "in_srs": input_wkt,
-                "out_srs": output_wkt
-            })
 
-    # Optional save
-    if save_pointcloud:
-        writer = {"type": "writers.las", "filename": f"{pointcloud_file}.{output_type}"}
-        if output_type == "laz":
-            writer.update({
-                "compression": "true",
-                "minor_version": "2",
-                "dataformat_id": "0"
-            })
-        stages.append(writer)
+@functools.lru_cache(maxsize=32)
+def _read_wkt_file(path):
+    return open(path).read()
 
-    # Noise‐trim Z outliers
-    if percentile_filter:
-        stages.append({
-            "type": "filters.python",
-            "script": "/home/jehayes/Stereotypical_Helens/filter_percentile.py",
-            "module": "filter_percentile",
-            "function": "filter_percentile",
-            "pdalargs": {"percentile_threshold": percentile_threshold}
-        })
 
-    # DSM only: canopy‐percentile RH_x
-    if product == "dsm":
-        stages.append({
-            "type": "filters.python",
-            "script": "/home/jehayes/Stereotypical_Helens/filter_local_percentile.py",
-            "module": "filter_local_percentile",
-            "function": "filter_local_percentile",
-            "pdalargs": {"percentile_threshold": dsm_percentile}
-        })
+def _resolve_wkt(crs):
+    """
+    Accept a WKT string or a path to a WKT file. WKT strings are recognized
+    by prefix so the hot per-tile path pays no stat syscall; file loads are
+    cached since the same base WKT path recurs for every tile in a batch.
+    """
+    if crs.lstrip().startswith(_WKT_PREFIXES):
+        return crs
+    if os.path.isfile(crs):
+        return _read_wkt_file(crs)
+    return crs
+
+
+# GeoDataFrames are unhashable, so the crop cache keys on (id(aoi), wkt) in
+# a plain dict. An lru_cache would be unsafe here: its entries outlive the
+# AOI, so a later frame allocated at a recycled id would silently get the
+# dead AOI's polygon. Instead a weakref.finalize per tracked AOI purges its
+# entries the moment the frame is collected, so an id can never alias.
+_crop_cache = {}
+_tracked_aoi_ids = set()
+
+
+def _evict_aoi(aoi_id):
+    _tracked_aoi_ids.discard(aoi_id)
+    for key in [k for k in _crop_cache if k[0] == aoi_id]:
+        del _crop_cache[key]
+
+
+def _crop_wkb_hex(aoi, input_wkt):
+    """
+    Project the AOI into the horizontal component of input_wkt and union it
+    into a single crop polygon, cached per (AOI object, input CRS): to_crs
+    plus union over a non-trivial AOI costs seconds, and a mosaic run
+    rebuilds pipelines for hundreds of tiles sharing one AOI and zone.
+    shapely.union_all runs a GEOS STRtree-based union over the whole
+    geometry array, much faster than the deprecated per-geometry cascaded
+    GeoSeries.unary_union for multi-polygon AOIs. WKB-hex skips the
+    double<->decimal text round-trip of WKT on both the GEOS encode side
+    and PDAL's parse side; filters.crop auto-detects it.
+    """
+    key = (id(aoi), input_wkt)
+    hit = _crop_cache.get(key)
+    if hit is not None:
+        return hit
+    if id(aoi) not in _tracked_aoi_ids:
+        _tracked_aoi_ids.add(id(aoi))
+        weakref.finalize(aoi, _evict_aoi, id(aoi))
+    aoi_m = aoi.to_crs(_horiz_epsg(input_wkt))
+    wkb = shapely.union_all(aoi_m.geometry.values).wkb_hex
+    _crop_cache[key] = wkb
+    return wkb
+
+
+# Sentinel tokens for per-tile fields in the pre-serialized template. JSON is
+# full of literal braces, so str.format_map placeholders would need the whole
+# document brace-escaped; plain replace on unique tokens is simpler and safe.
+_TPL_LAZ_FILE = "__LAZ_FILE__"
+_TPL_POINTCLOUD_FILE = "__POINTCLOUD_FILE__"
+
+
+@functools.lru_cache(maxsize=32)
+def _pipeline_template_json(
+    crop_poly, input_wkt, output_wkt, product,
+    filter_low_noise, filter_high_noise, reset_classes, reclassify_ground,
+    group_filter, reproject, save_pointcloud, output_type,
+    percentile_filter, percentile_threshold, percentile_zcut, dsm_percentile,
+    streaming, outlier_method, sample_radius, is_copc,
+):
+    stages = _build_stages(
+        _TPL_LAZ_FILE, crop_poly, input_wkt, output_wkt, product,
+        filter_low_noise, filter_high_noise, reset_classes, reclassify_ground,
+        group_filter, reproject, save_pointcloud, _TPL_POINTCLOUD_FILE,
+        output_type, percentile_filter, percentile_threshold, percentile_zcut,
+        dsm_percentile, streaming, outlier_method, sample_radius, None,
+        is_copc=is_copc,
+    )
+    return json.dumps({"pipeline": stages})
+
+
+def build_pipeline_template(
+    aoi,
+    input_crs=None,
+    output_crs=None,
+    product="dsm",
+    filter_low_noise=True,
+    filter_high_noise=True,
+    reset_classes=False,
+    reclassify_ground=False,
+    group_filter=None,
+    reproject=True,
+    save_pointcloud=False,
+    output_type="laz",
+    percentile_filter=True,
+    percentile_threshold=0.95,
+    percentile_zcut=None,
+    dsm_percentile=0.98,
+    streaming=False,
+    outlier_method="elm",
+    sample_radius=None,
+    is_copc=False
+):
+    """
+    Build the pipeline once per (AOI, CRS, flags) combo as a pre-serialized
+    JSON string with per-tile placeholders. json.dumps re-walks every stage
+    dict on every call; for a 1000-tile mosaic where only the filename
+    changes, serializing once and substituting per tile removes that cost.
+    The filename slot is a suffix-less token, so COPC tiles must ask for the
+    readers.copc template explicitly via is_copc=True.
+    Use with render_pipeline:
+
+        tpl = build_pipeline_template(aoi, input_crs=in_wkt, output_crs=out_wkt)
+        p = pdal.Pipeline(render_pipeline(tpl, laz_file))
+    """
+    assert input_crs and output_crs
+    assert product in ("dsm", "dtm")
+
+    input_wkt = _resolve_wkt(input_crs)
+    output_wkt = _resolve_wkt(output_crs)
+    crop_poly = _crop_wkb_hex(aoi, input_wkt)
+
+    return _pipeline_template_json(
+        crop_poly, input_wkt, output_wkt, product,
+        filter_low_noise, filter_high_noise, reset_classes, reclassify_ground,
+        group_filter, reproject, save_pointcloud, output_type,
+        percentile_filter, percentile_threshold, percentile_zcut,
+        dsm_percentile, streaming, outlier_method, sample_radius, is_copc,
+    )
+
+
+def render_pipeline(template, laz_file, pointcloud_file="pointcloud"):
+    """
+    Fill the per-tile slots of a build_pipeline_template string. Values are
+    JSON-escaped so paths with special characters stay valid.
+    """
+    rendered = template.replace(_TPL_LAZ_FILE, json.dumps(laz_file)[1:-1])
+    return rendered.replace(_TPL_POINTCLOUD_FILE, json.dumps(pointcloud_file)[1:-1])
+
+
+def read_classification_counts(laz_path):
+    """
+    One cheap stats pass over just the Classification dimension, returning
+    {class: count}. Worth running once per tile when the source lidar may
+    not carry noise classes at all -- the histogram lets create_pdal_pipeline
+    drop predicates that would scan every point to remove nothing.
+    """
+    pipeline = pdal.Pipeline(json.dumps({"pipeline": [
+        {"type": "readers.las", "filename": laz_path},
+        {"type": "filters.stats", "dimensions": "Classification",
+         "enumerate": "Classification"},
+    ]}))
+    pipeline.execute()
+    stat = pipeline.metadata["metadata"]["filters.stats"]["statistic"][0]
+    values = stat.get("values", [])
+    counts = stat.get("counts", [])
+    # PDAL emits counts as "value/count" strings in some versions
+    if counts and isinstance(counts[0], str):
+        pairs = (c.split("/") for c in counts)
+        return {int(float(v)): int(n) for v, n in pairs}
+    return {int(v): int(n) for v, n in zip(values, counts)}
+
+
+def build_pipelines_for_directory(laz_dir, aoi, base_utm_wkt_path, **pipeline_kwargs):
+    """
+    Build ready-to-execute pipeline JSON for every tile in laz_dir that
+    actually overlaps the AOI. Headers are read in parallel (quickinfo is an
+    IO-bound header read, so threads overlap the disk latency), tile bboxes
+    go into a shapely STRtree so non-overlapping tiles are rejected without
+    building anything, and the surviving tiles render from the cached
+    pipeline template. Extra kwargs are passed to build_pipeline_template.
+
+    Returns a list of (laz_path, pipeline_json) pairs, sorted by path;
+    each json string can be handed straight to pdal.Pipeline.
+    """
+    laz_paths = sorted(
+        os.path.join(laz_dir, name) for name in os.listdir(laz_dir)
+        if name.lower().endswith((".las", ".laz", ".copc"))
+    )
+
+    # Warm the header cache concurrently; everything below hits the cache
+    with concurrent.futures.ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(_header, laz_paths))
+
+    by_crs = {}
+    for path in laz_paths:
+        wkt, bbox = _header(path)
+        by_crs.setdefault(wkt, []).append((path, bbox))
+
+    # Bbox-vs-AOI prefilter per input CRS (the AOI union is cached, and the
+    # crop WKB decodes back to a geometry cheaper than re-unioning)
+    keep = []
+    for inp_wkt, tiles in by_crs.items():
+        aoi_geom = shapely.from_wkb(bytes.fromhex(_crop_wkb_hex(aoi, inp_wkt)))
+        boxes = shapely.box(
+            np.array([b[0] for _, b in tiles]),
+            np.array([b[2] for _, b in tiles]),
+            np.array([b[1] for _, b in tiles]),
+            np.array([b[3] for _, b in tiles]),
+        )
+        tree = shapely.STRtree(boxes)
+        keep.extend((tiles[i][0], inp_wkt)
+                    for i in tree.query(aoi_geom, predicate="intersects"))
+
+    # Zone detection batched over the surviving tiles only
+    out_wkts = detect_output_utm_crs_g2139_wkt_batch(
+        [path for path, _ in keep], base_utm_wkt_path)
+
+    pipelines = []
+    for path, inp_wkt in keep:
+        # The template's filename slot is a bare token, so COPC tiles must
+        # request the readers.copc variant explicitly or the crop push-down
+        # from the suffix check in _build_stages never engages.
+        template = build_pipeline_template(
+            aoi, input_crs=inp_wkt, output_crs=out_wkts[path],
+            is_copc=path.lower().endswith((".copc", ".copc.laz")),
+            **pipeline_kwargs)
+        pipelines.append((path, render_pipeline(template, path)))
+    pipelines.sort()
+    return pipelines
 
-    return stages
 
 def create_dem_stage(
     dsm_filename="dsm_output.tif",
@@ -428,8 +891,12 @@ def create_dem_stage(
         "nodata": -9999,
         "output_type": gridmethod,
         "resolution": float(pointcloud_resolution),
+        # PREDICTOR=2 delta-encodes before LZW (2-3x better ratio on
+        # smooth surfaces), NUM_THREADS parallelizes the compression, and
+        # BIGTIFF=IF_SAFER avoids a hard failure past 4GB
         "gdalopts": (
-            "COMPRESS=LZW,TILED=YES,blockxsize=256,blockysize=256,COPY_SRC_OVERVIEWS=YES"
+            "COMPRESS=LZW,PREDICTOR=2,TILED=YES,BLOCKXSIZE=256,BLOCKYSIZE=256,"
+            "COPY_SRC_OVERVIEWS=YES,NUM_THREADS=ALL_CPUS,BIGTIFF=IF_SAFER"
         )
     }
     # Only retain positive Z values for surface models
@@ -17,13 +17,23 @@ Test case:
     https://rockyweb.usgs.gov/vdelivery/Datasets/Staged/Elevation/LPC/Projects/legacy/WA_MT_ST_HELENS_2009/metadata/
 """
 
+import argparse
+import csv
+import io
+import logging
+import logging.handlers
+import os
+import queue
+import sqlite3
 import sys
-import requests
-from bs4 import BeautifulSoup
-import xml.etree.ElementTree as ET
+import threading
+import time
+import httpx
+import pyarrow.csv as pacsv
+import pyarrow.parquet as pq
+from lxml import etree, html
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from tqdm import tqdm
-import pandas as pd
 
 # ------------------------------------------------------------------------------
 # Configuration
@@ -33,8 +43,71 @@ BASE_XML_URL = (
     "vdelivery/Datasets/Staged/Elevation/LPC/Projects/legacy/"
     "WA_MT_ST_HELENS_2009/metadata/"
 )
-MAX_WORKERS = 16       # number of parallel threads to fetch XMLs
+# Thread count for the XML fetches. These workers spend their lives blocked
+# on ~11 KB round-trips, so the right size tracks latency, not cores -- the
+# old hardcoded 16 left most of the RTT window idle on modern machines.
+# Override per-run with --workers or persistently via XML_FETCH_WORKERS.
+MAX_WORKERS = int(os.getenv("XML_FETCH_WORKERS",
+                            str(min(64, (os.cpu_count() or 4) * 8))))
 REQUEST_TIMEOUT = 30   # HTTP request timeout in seconds
+CACHE_DB = "st_helens_xml_bbox_cache.sqlite"   # parsed bboxes + validators
+OUTPUT_CSV = "st_helens_2009_tile_bboxes_from_xml.csv"
+
+# Worker diagnostics go through a queue-backed logger instead of print():
+# with dozens of threads, every print serializes on the stdout lock right in
+# the hot loop. QueueHandler makes the worker side a lock-free enqueue and a
+# QueueListener thread (started in main) does the actual writing.
+log = logging.getLogger(__name__)
+
+# One shared HTTP/2 client: with h2 the server multiplexes many in-flight
+# GETs over a single TCP+TLS connection, so connection setup is paid once
+# for the whole run instead of per worker. httpx.Client is thread-safe, so
+# the existing thread pool drives it as-is; gzip roughly thirds the bytes
+# on the wire for this very repetitive XML. Connection-level retries live
+# in the transport (status-code handling stays with the callers).
+_SESSION = httpx.Client(
+    http2=True,
+    headers={"Accept-Encoding": "gzip"},
+    timeout=REQUEST_TIMEOUT,
+    limits=httpx.Limits(max_connections=MAX_WORKERS,
+                        max_keepalive_connections=MAX_WORKERS),
+    transport=httpx.HTTPTransport(retries=3),
+)
+
+# Tags worth stopping for while stream-parsing an FGDC file: the four bbox
+# leaves, plus </bounding> itself as the early-exit marker (the bbox sits
+# near the top of the schema, so most of each file never gets parsed).
+_BBOX_TAGS = ("westbc", "eastbc", "southbc", "northbc", "bounding")
+
+# Fast path: every file here follows the same FGDC template with the four
+# bounds in a fixed order, so they can be lifted with a straight
+# left-to-right bytes.find scan -- no tree, no decode, no regex engine.
+# Anything the scan cannot see falls back to the real parser.
+_FGDC_TAGS = (b"<westbc>", b"<eastbc>", b"<southbc>", b"<northbc>")
+_FGDC_ENDS = (b"</westbc>", b"</eastbc>", b"</southbc>", b"</northbc>")
+
+
+def _parse_fgdc(buf: bytes) -> list[float] | None:
+    """One pass over the raw bytes extracting [west, east, south, north];
+    None the moment anything deviates from the template (missing tag,
+    out-of-order tag, non-numeric text)."""
+    out = [0.0, 0.0, 0.0, 0.0]
+    i = 0
+    for k in range(4):
+        a = buf.find(_FGDC_TAGS[k], i)
+        if a < 0:
+            return None
+        a += len(_FGDC_TAGS[k])
+        b = buf.find(_FGDC_ENDS[k], a)
+        if b < 0:
+            return None
+        try:
+            # float() takes the bytes slice directly, whitespace and all
+            out[k] = float(buf[a:b])
+        except ValueError:
+            return None
+        i = b
+    return out
 
 # ------------------------------------------------------------------------------
 # Helper: list all XML filenames from the metadata directory
@@ -46,86 +119,313 @@ def list_xml_files(base_url: str) -> list[str]:
       ["USGS_LPC_WA_MT_ST_HELENS_2009_000001.xml", ...].
     """
     try:
-        response = requests.get(base_url, timeout=REQUEST_TIMEOUT)
+        response = _SESSION.get(base_url)
         response.raise_for_status()
     except Exception as e:
         print(f"[ERROR] Unable to fetch XML directory listing: {e}")
         sys.exit(1)
 
-    soup = BeautifulSoup(response.text, "html.parser")
+    # lxml's C HTML parser chews through a directory listing with tens of
+    # thousands of anchors far faster than the pure-Python html.parser
+    # backend BeautifulSoup was using, and the @href XPath skips building
+    # soup wrappers per tag entirely.
+    tree = html.fromstring(response.content)
     xml_files = []
-    for anchor in soup.find_all("a", href=True):
-        href = anchor["href"].strip()
+    for href in tree.xpath("//a/@href"):
+        href = href.strip()
         if href.lower().endswith(".xml"):
             # Skip parent- or current-directory links like "../"
             if href not in ("../", "./", "/"):
                 xml_files.append(href)
 
-    return sorted(set(xml_files))
+    # Directory listings come back server-sorted, so dedupe in insertion
+    # order (dict.fromkeys is one hash pass) and only pay for a sort when a
+    # quick monotonicity check says the server order actually needs it
+    deduped = list(dict.fromkeys(xml_files))
+    if all(deduped[i] <= deduped[i + 1] for i in range(len(deduped) - 1)):
+        return deduped
+    return sorted(deduped)
+
+
+def iter_xml_files(base_url: str):
+    """
+    Streaming variant of list_xml_files: yields .xml hrefs as their anchors
+    arrive off the wire, so the caller can start fetching the first files
+    while the rest of the index is still downloading. No dedupe or sort --
+    the caller handles both.
+    """
+    try:
+        with _SESSION.stream("GET", base_url) as response:
+            response.raise_for_status()
+            for _, anchor in etree.iterparse(
+                    _IterStream(response.iter_bytes()),
+                    events=("end",), tag="a", html=True):
+                href = (anchor.get("href") or "").strip()
+                anchor.clear()
+                if href.lower().endswith(".xml") and href not in ("../", "./", "/"):
+                    yield href
+    except Exception as e:
+        print(f"[ERROR] Unable to fetch XML directory listing: {e}")
+        sys.exit(1)
 
 
 # ------------------------------------------------------------------------------
 # Helper: download and parse a single XML, extract bounding coordinates
 # ------------------------------------------------------------------------------
-def fetch_xml_bbox(filename: str, base_url: str) -> dict[str, float] | None:
+def _load_cache() -> dict[str, tuple]:
+    """Rows from previous runs, keyed on XML filename. Each row carries the
+    parsed bbox plus the server's ETag/Last-Modified validators."""
+    con = sqlite3.connect(CACHE_DB)
+    con.execute(
+        "CREATE TABLE IF NOT EXISTS bboxes ("
+        "filename TEXT PRIMARY KEY, etag TEXT, last_modified TEXT, "
+        "minx REAL, maxx REAL, miny REAL, maxy REAL)"
+    )
+    rows = {r[0]: r for r in con.execute(
+        "SELECT filename, etag, last_modified, minx, maxx, miny, maxy FROM bboxes")}
+    con.close()
+    return rows
+
+
+def _store_cache(rows: list[tuple]) -> None:
+    if not rows:
+        return
+    con = sqlite3.connect(CACHE_DB)
+    con.executemany("INSERT OR REPLACE INTO bboxes VALUES (?,?,?,?,?,?,?)", rows)
+    con.commit()
+    con.close()
+
+
+def _cached_bbox(row: tuple) -> tuple:
+    filename, _, _, minx, maxx, miny, maxy = row
+    return (filename.replace(".xml", ".laz"), minx, maxx, miny, maxy)
+
+
+class _AdaptiveLimiter:
     """
-    Download one XML file (about 11 KB) and extract geographic bounds from:
-        <spdom>
-          <bounding>
-            <westbc>... (longitude minimum)</westbc>
-            <eastbc>... (longitude maximum)</eastbc>
-            <southbc>... (latitude minimum)</southbc>
-            <northbc>... (latitude maximum)</northbc>
-          </bounding>
-        </spdom>
-    Returns a dictionary:
-      {
-        "filename": "<name>.laz",
-        "minx": <float(westbc)>,
-        "maxx": <float(eastbc)>,
-        "miny": <float(southbc)>,
-        "maxy": <float(northbc)>
-      }
-    or returns None if the XML cannot be parsed or fields are missing.
+    Keeps in-flight requests near the server's sweet spot: a 429/503 halves
+    the admission cap (and honors Retry-After), a sustained streak of clean
+    responses doubles it back up to the pool size. Past the sweet spot,
+    extra concurrency against one origin only buys queueing and tar-pitting,
+    so backing off improves throughput as well as latency.
+    """
+
+    def __init__(self, max_permits: int):
+        self._max = max_permits
+        self._limit = max_permits
+        self._inflight = 0
+        self._streak = 0
+        self._cond = threading.Condition()
+
+    def __enter__(self):
+        with self._cond:
+            while self._inflight >= self._limit:
+                self._cond.wait()
+            self._inflight += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._cond:
+            self._inflight -= 1
+            self._cond.notify()
+
+    def throttle(self, retry_after: float = 1.0) -> None:
+        with self._cond:
+            self._limit = max(1, self._limit // 2)
+            self._streak = 0
+        time.sleep(retry_after)
+
+    def success(self) -> None:
+        with self._cond:
+            self._streak += 1
+            if self._streak >= 50 and self._limit < self._max:
+                self._limit = min(self._max, self._limit * 2)
+                self._streak = 0
+                self._cond.notify_all()
+
+
+def _retry_after_seconds(response, default: float = 1.0) -> float:
+    try:
+        return float(response.headers.get("retry-after", default))
+    except ValueError:
+        # HTTP-date form; a flat second is close enough for a backoff hint
+        return default
+
+
+def _fetch_conditional(filename: str, base_url: str, cached: tuple | None,
+                       limiter: _AdaptiveLimiter | None = None):
+    """
+    Conditional download: when a cached row exists its validators go out as
+    If-None-Match/If-Modified-Since, and a 304 answer costs the server no
+    body at all -- on a warm run the whole pass is 304s and the network cost
+    collapses to headers. Returns ("hit", None, None, None) on 304,
+    ("miss", body, etag, last_modified) on 200, or None on failure.
     """
     url = base_url.rstrip("/") + "/" + filename
+    headers = {}
+    if cached is not None:
+        if cached[1]:
+            headers["If-None-Match"] = cached[1]
+        if cached[2]:
+            headers["If-Modified-Since"] = cached[2]
     try:
-        response = requests.get(url, timeout=REQUEST_TIMEOUT)
+        if limiter is None:
+            response = _SESSION.get(url, headers=headers)
+        else:
+            with limiter:
+                response = _SESSION.get(url, headers=headers)
+            if response.status_code in (429, 503):
+                # Back off, shrink the window, then retry once
+                limiter.throttle(_retry_after_seconds(response))
+                with limiter:
+                    response = _SESSION.get(url, headers=headers)
+        if response.status_code == 304:
+            if limiter is not None:
+                limiter.success()
+            return ("hit", None, None, None)
         response.raise_for_status()
+        if limiter is not None:
+            limiter.success()
+        return ("miss", response.content,
+                response.headers.get("etag", ""),
+                response.headers.get("last-modified", ""))
     except Exception as e:
-        print(f"[ERROR] {filename}: HTTP error: {e}")
+        log.error("%s: HTTP error: %s", filename, e)
         return None
 
+
+def _fetch_body(filename: str, base_url: str) -> bytes | None:
+    """Download one XML and return its raw bytes (None on HTTP failure).
+    Pure I/O so it is all the worker threads ever run."""
+    url = base_url.rstrip("/") + "/" + filename
+    try:
+        response = _SESSION.get(url)
+        response.raise_for_status()
+        return response.content
+    except Exception as e:
+        log.error("%s: HTTP error: %s", filename, e)
+        return None
+
+
+class _IterStream:
+    """Minimal read()-only file object over an httpx byte iterator, so a
+    streamed response can feed lxml.iterparse without ever being joined
+    into one bytes object."""
+
+    def __init__(self, iterator):
+        self._iter = iterator
+        self._buf = b""
+
+    def read(self, size=-1):
+        while size < 0 or len(self._buf) < size:
+            try:
+                self._buf += next(self._iter)
+            except StopIteration:
+                break
+        if size < 0:
+            out, self._buf = self._buf, b""
+        else:
+            out, self._buf = self._buf[:size], self._buf[size:]
+        return out
+
+
+def _iterparse_bbox(filename: str, source) -> tuple | None:
+    """
+    Parse <bounding> out of a file-like XML source, bailing out at
+    </bounding>: the bbox lives near the top of the FGDC template, so the
+    bulk of each file never gets parsed. elem.clear() keeps the partial
+    tree from accumulating.
+    """
     try:
-        root = ET.fromstring(response.content)
-        # Look for <spdom><bounding> ... </bounding></spdom> anywhere in the document
-        bounding = root.find(".//spdom/bounding")
-        if bounding is None:
-            print(f"[WARN] {filename}: <spdom><bounding> element not found.")
+        vals = {}
+        for _, elem in etree.iterparse(
+                source, events=("end",), tag=_BBOX_TAGS,
+                collect_ids=False, resolve_entities=False):
+            tag = elem.tag
+            if tag == "bounding":
+                elem.clear()
+                break
+            vals[tag] = elem.text
+            elem.clear()
+
+        if not vals:
+            log.warning("%s: <spdom><bounding> element not found.", filename)
             return None
 
-        west = bounding.findtext("westbc")
-        east = bounding.findtext("eastbc")
-        south = bounding.findtext("southbc")
-        north = bounding.findtext("northbc")
+        west = vals.get("westbc")
+        east = vals.get("eastbc")
+        south = vals.get("southbc")
+        north = vals.get("northbc")
 
-        if None in (west, east, south, north):
-            print(f"[WARN] {filename}: One of westbc/eastbc/southbc/northbc is missing.")
+        # Explicit short-circuit checks: "None in (...)" builds a tuple and
+        # linear-scans it on every call
+        if west is None or east is None or south is None or north is None:
+            log.warning("%s: One of westbc/eastbc/southbc/northbc is missing.",
+                        filename)
             return None
 
-        return {
-            "filename": filename.replace(".xml", ".laz"),  # match the LAZ tile name
-            "minx": float(west),
-            "maxx": float(east),
-            "miny": float(south),
-            "maxy": float(north)
-        }
+        # First slot matches the LAZ tile name
+        return (filename.replace(".xml", ".laz"),
+                float(west), float(east), float(south), float(north))
 
-    except ET.ParseError as pe:
-        print(f"[ERROR] {filename}: XML parse error: {pe}")
+    except etree.XMLSyntaxError as pe:
+        log.error("%s: XML parse error: %s", filename, pe)
+        return None
+    except Exception as e:
+        log.error("%s: Unexpected error: %s", filename, e)
         return None
+
+
+def _parse_bbox(filename: str, body: bytes, fast_path: bool = True) -> tuple | None:
+    """Extract the bounds from a downloaded FGDC body. Pure CPU and
+    module-level, so it could be shipped to a process pool unchanged if the
+    parse share of wall time ever grows."""
+    if fast_path:
+        vals = _parse_fgdc(body)
+        if vals is not None:
+            return (filename.replace(".xml", ".laz"),
+                    vals[0], vals[1], vals[2], vals[3])
+    return _iterparse_bbox(filename, io.BytesIO(body))
+
+
+def fetch_xml_bbox(filename: str, base_url: str, fast_path: bool = True) -> tuple | None:
+    """
+    Download one XML file (about 11 KB) and extract geographic bounds from:
+        <spdom>
+          <bounding>
+            <westbc>... (longitude minimum)</westbc>
+            <eastbc>... (longitude maximum)</eastbc>
+            <southbc>... (latitude minimum)</southbc>
+            <northbc>... (latitude maximum)</northbc>
+          </bounding>
+        </spdom>
+    Returns a (filename, minx, maxx, miny, maxy) tuple -- filename with the
+    .laz extension, bounds as floats in the order west, east, south, north
+    -- or None if the XML cannot be parsed or fields are missing. A plain
+    tuple is a fraction of the size of the dict this used to return, which
+    matters when tens of thousands of rows pass through the collector.
+
+    With fast_path (default) the bounds are extracted by a single byte scan
+    specialized to the FGDC template, skipping XML parsing entirely;
+    malformed or unexpected files transparently fall back to the streaming
+    parser.
+    Without it the response streams network->parser with no full-body
+    buffer in between, and the early exit at </bounding> means the tail of
+    each file is never even downloaded.
+    """
+    if fast_path:
+        body = _fetch_body(filename, base_url)
+        if body is None:
+            return None
+        return _parse_bbox(filename, body, fast_path=True)
+
+    url = base_url.rstrip("/") + "/" + filename
+    try:
+        with _SESSION.stream("GET", url) as response:
+            response.raise_for_status()
+            return _iterparse_bbox(filename, _IterStream(response.iter_bytes()))
     except Exception as e:
-        print(f"[ERROR] {filename}: Unexpected error: {e}")
+        log.error("%s: HTTP error: %s", filename, e)
         return None
 
 
@@ -133,45 +433,109 @@ def fetch_xml_bbox(filename: str, base_url: str) -> dict[str, float] | None:
 # Main routine: fetch, parse, and save bounding boxes
 # ------------------------------------------------------------------------------
 def main():
+    parser = argparse.ArgumentParser(
+        description="Map USGS legacy LAZ tile names to geographic bounds "
+                    "by scraping the per-tile FGDC metadata XMLs.")
+    parser.add_argument("--workers", type=int, default=MAX_WORKERS,
+                        help="parallel fetch threads (default: %(default)s, "
+                             "or set XML_FETCH_WORKERS)")
+    args = parser.parse_args()
+
+    # Non-blocking logging: workers enqueue records, this listener thread
+    # formats and writes them, so stdout contention never reaches the pool
+    log_queue: queue.SimpleQueue = queue.SimpleQueue()
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("[%(levelname)s] %(message)s"))
+    listener = logging.handlers.QueueListener(log_queue, stream_handler)
+    log.addHandler(logging.handlers.QueueHandler(log_queue))
+    log.setLevel(logging.INFO)
+    listener.start()
+
     print("Fetching list of XML files from the USGS metadata directory...")
-    xml_files = list_xml_files(BASE_XML_URL)
-    if not xml_files:
-        print("No XML files found. Exiting.")
-        sys.exit(0)
-
-    print(f"Found {len(xml_files)} XML files.\n")
-
-    results: list[dict[str, float]] = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Submit a task to fetch each XML's bounding box
-        future_to_name = {
-            executor.submit(fetch_xml_bbox, xml_name, BASE_XML_URL): xml_name
-            for xml_name in xml_files
-        }
-
-        # As each future completes, collect its result
-        for future in tqdm(as_completed(future_to_name), total=len(future_to_name), desc="Processing XMLs"):
-            xml_name = future_to_name[future]
-            bbox = future.result()
+    xml_files: list[str] = []
+    seen: set[str] = set()
+    n_rows = 0
+    # Rows go straight from the collector loop to disk: peak memory stays
+    # constant no matter how many tiles the project has, and a crashed run
+    # leaves a usable partial CSV behind
+    with ThreadPoolExecutor(max_workers=args.workers) as executor, \
+            open(OUTPUT_CSV, "w", newline="") as csv_file:
+        csv_writer = csv.writer(csv_file)
+        csv_writer.writerow(["filename", "minx", "maxx", "miny", "maxy"])
+        # Submit each XML's fetch the moment its anchor streams in, so the
+        # first bodies are already in flight while the tail of the index is
+        # still downloading -- the old list-then-submit order serialized a
+        # full index round-trip in front of everything.
+        # Workers only move bytes; the (regex) parse runs on the collector
+        # side so the pool threads never contend over Python-level work and
+        # stay parked on the network where they belong.
+        cache = _load_cache()
+        new_rows: list[tuple] = []
+        limiter = _AdaptiveLimiter(args.workers)
+        future_to_idx: dict = {}
+        for xml_name in iter_xml_files(BASE_XML_URL):
+            if xml_name in seen:
+                continue
+            seen.add(xml_name)
+            future_to_idx[executor.submit(
+                _fetch_conditional, xml_name, BASE_XML_URL,
+                cache.get(xml_name), limiter)] = len(xml_files)
+            xml_files.append(xml_name)
+
+        if not xml_files:
+            print("No XML files found. Exiting.")
+            sys.exit(0)
+
+        print(f"Found {len(xml_files)} XML files.\n")
+
+        # As each future completes, parse and collect its result. The bar
+        # wraps a manual update rather than the as_completed generator, and
+        # batches redraws: per-completion rendering is a Python-level write
+        # (holding the GIL) for every one of thousands of tiny tasks.
+        pbar = tqdm(total=len(future_to_idx), desc="Processing XMLs",
+                    mininterval=0.5, smoothing=0.1,
+                    miniters=max(1, len(future_to_idx) // 200))
+        for future in as_completed(future_to_idx):
+            pbar.update(1)
+            i = future_to_idx[future]
+            xml_name = xml_files[i]
+            outcome = future.result()
+            if outcome is None:
+                continue
+            status, body, etag, last_modified = outcome
+            if status == "hit":
+                bbox = _cached_bbox(cache[xml_name])
+            else:
+                bbox = _parse_bbox(xml_name, body)
+                if bbox is not None:
+                    new_rows.append((xml_name, etag, last_modified) + bbox[1:])
             if bbox is not None:
-                results.append(bbox)
+                csv_writer.writerow(bbox)
+                n_rows += 1
+
+        pbar.close()
+
+    listener.stop()
+    _store_cache(new_rows)
 
-    if not results:
+    if n_rows == 0:
         print("Failed to parse any XML bounding boxes. Exiting.")
         sys.exit(1)
 
-    # Build a DataFrame from the results
-    df = pd.DataFrame(results)
-    df = df.sort_values("filename").reset_index(drop=True)
+    # One read-back pass restores the sorted order (rows hit disk in
+    # completion order) and emits the parquet twin; the only whole-dataset
+    # object ever held in memory is this final Arrow table
+    output_parquet = OUTPUT_CSV.replace(".csv", ".parquet")
+    table = pacsv.read_csv(OUTPUT_CSV).sort_by("filename")
+    pacsv.write_csv(table, OUTPUT_CSV)
+    pq.write_table(table, output_parquet)
 
     # Print a small preview
     print("\nSample of retrieved bounding boxes:")
-    print(df.head(10).to_string(index=False, float_format="{:,.6f}".format))
+    print(table.slice(0, 10).to_pandas().to_string(
+        index=False, float_format="{:,.6f}".format))
 
-    # Save the results to CSV
-    output_csv = "st_helens_2009_tile_bboxes_from_xml.csv"
-    df.to_csv(output_csv, index=False)
-    print(f"\nDone. Saved results to '{output_csv}'.")
+    print(f"\nDone. Saved results to '{OUTPUT_CSV}' (and '{output_parquet}').")
 
     print("\nEach row in the CSV contains:")
     print("  filename : the .laz tile name (e.g., USGS_LPC_WA_MT_ST_HELENS_2009_000001.laz)")